@@ -1,30 +1,159 @@
 import platform
 import psutil
 import socket
-import json
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 import sys
 import datetime
 import logging
 import os
 import time
 import uuid
+import heapq
+import random
+import email.utils
+import signal
+import atexit
+from collections import deque
+import threading
+from logging.handlers import MemoryHandler
+
+class BufferedFileHandler(logging.FileHandler):
+    """FileHandler con buffer de 64 KB que solo vuelca a disco en ERROR o al hacer flush()"""
+    
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=65536,
+                    encoding=self.encoding or 'utf-8', errors=self.errors)
+    
+    def emit(self, record):
+        # Igual que StreamHandler.emit pero sin flush() por registro
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= logging.ERROR:
+                self.stream.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
 
 # Configurar logging para archivo y consola
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-# Archivo
-file_handler = logging.FileHandler('agent.log')
+# Archivo: los registros se acumulan en memoria y se escriben por lotes
+# (cada LOG_FLUSH_SECS, al llenarse el buffer o de inmediato si son ERROR)
+LOG_FLUSH_SECS = 1.0
+file_handler = BufferedFileHandler('agent.log')
 file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+memory_handler = MemoryHandler(capacity=512, flushLevel=logging.ERROR, target=file_handler)
+logger.addHandler(memory_handler)
 # Consola
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 
-def get_real_ip():
-    """Obtiene la IP real del host (no localhost)"""
+def _flush_logs():
+    """Vuelca a disco los registros pendientes (memoria y buffer del archivo)"""
+    memory_handler.flush()
+    file_handler.flush()
+
+def _schedule_log_flush():
+    """Vuelca los registros y reprograma el siguiente volcado"""
+    _flush_logs()
+    timer = threading.Timer(LOG_FLUSH_SECS, _schedule_log_flush)
+    timer.daemon = True
+    timer.start()
+
+_schedule_log_flush()
+atexit.register(_flush_logs)
+
+# Procesos conocidos entre iteraciones (pid -> psutil.Process). Reutilizar el
+# mismo objeto permite que cpu_percent(interval=None) devuelva el delta real.
+_proc_cache = {}
+
+# Lectura directa de /proc en Linux: ticks de CPU por proceso en la iteración
+# anterior ((pid, starttime) -> utime+stime) para calcular el delta
+if sys.platform.startswith('linux'):
+    _CLK_TCK = os.sysconf('SC_CLK_TCK')
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+    _MEM_TOTAL = psutil.virtual_memory().total
+    _PROC_STATUS = {
+        'R': psutil.STATUS_RUNNING, 'S': psutil.STATUS_SLEEPING,
+        'D': psutil.STATUS_DISK_SLEEP, 'Z': psutil.STATUS_ZOMBIE,
+        'T': psutil.STATUS_STOPPED, 't': psutil.STATUS_TRACING_STOP,
+        'X': psutil.STATUS_DEAD, 'I': psutil.STATUS_IDLE,
+        'W': psutil.STATUS_WAKING, 'P': psutil.STATUS_PARKED
+    }
+_prev_cpu_ticks = {}
+_prev_snapshot_ts = 0.0
+
+# Datos del host que casi nunca cambian (CPU, SO, IP, usuarios). Se calculan
+# una vez y se refrescan periódicamente en lugar de en cada iteración.
+STATIC_REFRESH_SECS = int(os.getenv('STATIC_REFRESH_SECS', 600))
+IP_REFRESH_SECS = int(os.getenv('IP_REFRESH_SECS', 600))
+USERS_REFRESH_EVERY = int(os.getenv('USERS_REFRESH_EVERY', 5))
+_static_cache = {}
+_last_static_refresh = 0.0
+_ip_cache = {'ip': None, 'expires': 0.0}
+_users_iterations = 0
+
+# Sesión HTTP compartida: reutiliza la conexión TCP/TLS entre envíos. Los
+# reintentos los gestiona send_to_api, por eso el adaptador no reintenta.
+_session = requests.Session()
+_session.headers['Connection'] = 'keep-alive'
+_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+_session.mount('http://', _adapter)
+_session.mount('https://', _adapter)
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+# Espera máxima entre reintentos; un Retry-After mayor hace abandonar el envío
+MAX_BACKOFF_SECS = float(os.getenv('MAX_BACKOFF_SECS', 30))
+
+# Buffer de snapshots pendientes. Se envían juntos en un solo POST cuando se
+# acumulan BATCH_SIZE o el más antiguo supera BATCH_MAX_AGE_SECS (0 = sin límite
+# de antigüedad: solo cuenta BATCH_SIZE).
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 1))
+BATCH_MAX_AGE_SECS = float(os.getenv('BATCH_MAX_AGE_SECS', 0))
+_buf = deque()
+_first_ts = 0.0
+
+def _default_route_ip():
+    """Lee la interfaz de la ruta por defecto en /proc/net/route y devuelve su IPv4"""
+    with open('/proc/net/route') as f:
+        next(f)  # Cabecera
+        for line in f:
+            fields = line.split()
+            # Destino 00000000 = ruta por defecto; flag 0x1 = RTF_UP
+            if len(fields) > 3 and fields[1] == '00000000' and int(fields[3], 16) & 0x1:
+                for addr in psutil.net_if_addrs().get(fields[0], []):
+                    if addr.family == socket.AF_INET:
+                        return addr.address
+    return None
+
+def get_real_ip(force_refresh=False):
+    """Obtiene la IP real del host (no localhost), cacheada durante IP_REFRESH_SECS"""
+    now = time.monotonic()
+    if not force_refresh and now < _ip_cache['expires']:
+        return _ip_cache['ip']
+    
+    ip, cacheable = _resolve_real_ip()
+    _ip_cache['ip'] = ip
+    _ip_cache['expires'] = now + IP_REFRESH_SECS if cacheable else 0
+    return ip
+
+def _resolve_real_ip():
+    """Resuelve la IP del host; devuelve (ip, si el resultado puede cachearse)"""
+    if sys.platform.startswith('linux'):
+        try:
+            # Método 0: interfaz de la ruta por defecto, sin abrir sockets
+            ip = _default_route_ip()
+            if ip:
+                return ip, True
+        except Exception as e:
+            logging.warning(f"Método 0 falló: {e}")
+    
     try:
         # Método 1: Conectar a un servidor externo (no envía datos, solo abre socket)
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -33,9 +162,14 @@ def get_real_ip():
         s.connect(("8.8.8.8", 80))
         ip = s.getsockname()[0]
         s.close()
-        return ip
+        return ip, True
+    except OSError as e:
+        # La red está cambiando: lo que se obtenga a continuación no se cachea
+        logging.warning(f"Método 1 falló: {e}")
+        network_down = True
     except Exception as e:
         logging.warning(f"Método 1 falló: {e}")
+        network_down = False
     
     try:
         # Método 2: Buscar en interfaces de red
@@ -50,7 +184,7 @@ def get_real_ip():
                     # Verificar que no sea localhost ni link-local
                     if not ip.startswith(('127.', '169.254.')):
                         logging.info(f"IP encontrada en interfaz {interface}: {ip}")
-                        return ip
+                        return ip, not network_down
     except Exception as e:
         logging.warning(f"Método 2 falló: {e}")
     
@@ -59,58 +193,45 @@ def get_real_ip():
         hostname = socket.gethostname()
         ip = socket.gethostbyname(hostname)
         if not ip.startswith('127.'):
-            return ip
+            return ip, not network_down
     except Exception as e:
         logging.warning(f"Método 3 falló: {e}")
     
     # Fallback
     logging.warning("No se pudo obtener IP real, usando 127.0.0.1")
-    return "127.0.0.1"
+    return "127.0.0.1", False
 
-def collect_system_info(agent_id):
-    logging.info("Iniciando recolección de datos")
-    
-    # Obtener IP real del host
-    ip = get_real_ip()
-    logging.info(f"IP detectada: {ip}")
-    
-    cpu_info = {
-        'count': psutil.cpu_count(),
-        'frequency': psutil.cpu_freq()._asdict() if psutil.cpu_freq() else None,
-        'model': platform.processor() or "Desconocido"
-    }
-    
-    processes = []
-    try:
-        # Primera llamada para inicializar
-        for proc in psutil.process_iter(['pid', 'name']):
-            try:
-                proc.cpu_percent(interval=None)
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                pass
-        
-        # Esperar un momento para que se acumulen datos
-        time.sleep(0.1)
-        
-        # Segunda llamada para obtener el porcentaje real
-        process_list = []
-        for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent', 'status']):
-            try:
-                pinfo = proc.info
-                # Obtener CPU% con un pequeño intervalo si es 0
-                if pinfo['cpu_percent'] == 0:
-                    pinfo['cpu_percent'] = proc.cpu_percent(interval=0.1)
-                process_list.append(pinfo)
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
-        
-        # Ordenar por CPU y tomar los top 10
-        processes = sorted(process_list, key=lambda p: p.get('cpu_percent', 0), reverse=True)[:10]
-        
-    except psutil.AccessDenied as e:
-        logging.error(f"Permisos insuficientes para procesos: {e}")
-    except Exception as e:
-        logging.error(f"Error recolectando procesos: {e}")
+def _get_static_os_cpu(force_refresh=False):
+    """Devuelve la info de CPU y SO, recalculándola cada STATIC_REFRESH_SECS"""
+    global _last_static_refresh
+    now = time.monotonic()
+    if force_refresh or 'cpu' not in _static_cache or now - _last_static_refresh >= STATIC_REFRESH_SECS:
+        freq = psutil.cpu_freq()
+        _static_cache['cpu'] = {
+            'count': psutil.cpu_count(),
+            'frequency': freq._asdict() if freq else None,
+            'model': platform.processor() or "Desconocido"
+        }
+        _static_cache['os'] = {
+            'name': platform.system(),
+            'version': platform.version(),
+            'release': platform.release(),
+            'hostname': socket.gethostname()
+        }
+        _last_static_refresh = now
+    return _static_cache['cpu'], _static_cache['os']
+
+def _invalidate_caches(signum=None, frame=None):
+    """Descarta los datos estáticos y la IP cacheados para que se recalculen"""
+    _static_cache.clear()
+    _ip_cache['expires'] = 0.0
+
+def _get_users(force_refresh=False):
+    """Devuelve los usuarios conectados, refrescados cada USERS_REFRESH_EVERY iteraciones"""
+    global _users_iterations
+    if not force_refresh and 'users' in _static_cache and _users_iterations < USERS_REFRESH_EVERY:
+        _users_iterations += 1
+        return _static_cache['users']
     
     # Usuarios del sistema
     users = []
@@ -132,12 +253,121 @@ def collect_system_info(agent_id):
         except Exception as e:
             logging.warning(f"No se pudo obtener info de usuario del proceso: {e}")
     
-    os_info = {
-        'name': platform.system(),
-        'version': platform.version(),
-        'release': platform.release(),
-        'hostname': socket.gethostname()
-    }
+    _static_cache['users'] = users
+    _users_iterations = 1
+    return users
+
+def _linux_fast_process_snapshot():
+    """Lee /proc/<pid>/stat directamente (un open+read por proceso) sin crear psutil.Process"""
+    global _prev_cpu_ticks, _prev_snapshot_ts
+    now = time.monotonic()
+    elapsed = now - _prev_snapshot_ts if _prev_snapshot_ts else 0.0
+    procfs = psutil.PROCFS_PATH
+    ticks = {}
+    process_list = []
+    for entry in os.listdir(procfs):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"{procfs}/{entry}/stat", 'rb') as f:
+                stat = f.read()
+        except OSError:
+            # El proceso terminó entre listdir() y open()
+            continue
+        # comm va entre paréntesis y puede contener espacios o ')'
+        rpar = stat.rfind(b')')
+        name = stat[stat.find(b'(') + 1:rpar].decode(errors='replace')
+        # fields[0] es el campo 3 (state): utime/stime = 14/15, starttime = 22, rss = 24
+        fields = stat[rpar + 2:].split()
+        pid = int(entry)
+        try:
+            total = int(fields[11]) + int(fields[12])
+            key = (pid, fields[19])
+            rss = int(fields[21])
+        except (ValueError, IndexError):
+            # stat truncado o con un formato inesperado
+            continue
+        ticks[key] = total
+        prev = _prev_cpu_ticks.get(key)
+        cpu_percent = 0.0
+        if prev is not None and elapsed > 0:
+            cpu_percent = round((total - prev) / _CLK_TCK / elapsed * 100, 1)
+        process_list.append({
+            'pid': pid,
+            'name': name,
+            'cpu_percent': cpu_percent,
+            'memory_percent': rss * _PAGE_SIZE / _MEM_TOTAL * 100,
+            'status': _PROC_STATUS.get(fields[0].decode(), '?')
+        })
+    _prev_cpu_ticks = ticks
+    _prev_snapshot_ts = now
+    return process_list
+
+def _psutil_process_snapshot():
+    """Recorre los procesos con psutil reutilizando los Process cacheados"""
+    # Sincronizar la caché con los PIDs actuales: se descartan los procesos
+    # terminados y se crean Process solo para los nuevos. Así cpu_percent()
+    # mide el delta desde la iteración anterior sin necesidad de dormir.
+    current_pids = set(psutil.pids())
+    for pid in list(_proc_cache):
+        if pid not in current_pids:
+            del _proc_cache[pid]
+    for pid in current_pids:
+        if pid not in _proc_cache:
+            try:
+                _proc_cache[pid] = psutil.Process(pid)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+    
+    process_list = []
+    for pid, proc in list(_proc_cache.items()):
+        try:
+            # Llamadas directas dentro de oneshot(): comparten una sola
+            # lectura de /proc/<pid>/stat y /status en lugar de una por campo
+            with proc.oneshot():
+                pinfo = {
+                    'pid': pid,
+                    'name': proc.name(),
+                    'cpu_percent': proc.cpu_percent(None),
+                    'memory_percent': proc.memory_percent(),
+                    'status': proc.status()
+                }
+            process_list.append(pinfo)
+        except psutil.NoSuchProcess:
+            _proc_cache.pop(pid, None)
+        except (psutil.AccessDenied, psutil.ZombieProcess):
+            pass
+    return process_list
+
+def collect_system_info(agent_id, force_refresh=False):
+    logging.info("Iniciando recolección de datos")
+    
+    # Datos estáticos cacheados; solo la frecuencia actual se lee cada vez
+    ip = get_real_ip(force_refresh)
+    logging.info(f"IP detectada: {ip}")
+    static_cpu, os_info = _get_static_os_cpu(force_refresh)
+    
+    cpu_info = dict(static_cpu)
+    freq = psutil.cpu_freq()
+    if freq and static_cpu['frequency']:
+        cpu_info['frequency'] = {**static_cpu['frequency'], 'current': freq.current}
+    
+    processes = []
+    try:
+        if sys.platform.startswith('linux'):
+            process_list = _linux_fast_process_snapshot()
+        else:
+            process_list = _psutil_process_snapshot()
+        
+        # Tomar los top 10 por CPU sin ordenar la lista completa
+        processes = heapq.nlargest(10, process_list, key=lambda p: p.get('cpu_percent', 0))
+        
+    except psutil.AccessDenied as e:
+        logging.error(f"Permisos insuficientes para procesos: {e}")
+    except Exception as e:
+        logging.error(f"Error recolectando procesos: {e}")
+    
+    users = _get_users(force_refresh)
     
     data = {
         'ip': ip,
@@ -146,7 +376,8 @@ def collect_system_info(agent_id):
         'processes': processes,
         'users': users,
         'os': os_info,
-        'timestamp': datetime.datetime.now().isoformat()
+        # orjson serializa datetime en ISO 8601 directamente
+        'timestamp': datetime.datetime.now()
     }
     
     logging.info(f"Datos recolectados: CPU processes found: {len(processes)}")
@@ -155,11 +386,29 @@ def collect_system_info(agent_id):
     
     return data
 
+def _retry_after_secs(response):
+    """Segundos pedidos por la cabecera Retry-After (0 si no viene o no es válida)"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        # Formato fecha HTTP
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return 0.0
+
 def send_to_api(data, api_url, retries=3, backoff=2):
     logging.info(f"Enviando datos a {api_url}")
+    body = orjson.dumps(data)
     for attempt in range(retries):
+        retry_after = 0.0
         try:
-            response = requests.post(api_url, json=data, timeout=10)
+            response = _session.post(api_url, data=body, headers=_JSON_HEADERS, timeout=10)
             if response.status_code == 200:
                 print("Datos enviados exitosamente.")
                 logging.info("Envío exitoso.")
@@ -167,14 +416,54 @@ def send_to_api(data, api_url, retries=3, backoff=2):
             else:
                 print(f"Error HTTP: {response.status_code}")
                 logging.error(f"Error HTTP: {response.status_code}")
+            if response.status_code in (429, 503):
+                retry_after = _retry_after_secs(response)
+            elif 400 <= response.status_code < 500:
+                # Un error del cliente no se arregla reintentando
+                logging.error("Error de cliente, no se reintenta.")
+                return False
         except Exception as e:
             print(f"Error en envío: {e}")
             logging.error(f"Error: {e}")
         if attempt < retries - 1:
-            time.sleep(backoff * (2 ** attempt))
+            if retry_after > MAX_BACKOFF_SECS:
+                logging.error(f"Retry-After de {retry_after:.0f}s supera el máximo, se abandona el envío.")
+                return False
+            # Jitter para que los agentes no reintenten todos a la vez; el tope se
+            # aplica después para que la espera nunca supere MAX_BACKOFF_SECS
+            sleep_s = min(MAX_BACKOFF_SECS, backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+            time.sleep(max(sleep_s, retry_after))
     logging.error("Fallo tras reintentos.")
     return False
 
+def buffer_snapshot(info, api_url):
+    """Acumula un snapshot y vacía el buffer si se alcanzó algún umbral"""
+    global _first_ts
+    if not _buf:
+        _first_ts = time.monotonic()
+    _buf.append(info)
+    if len(_buf) >= BATCH_SIZE or (BATCH_MAX_AGE_SECS > 0 and time.monotonic() - _first_ts >= BATCH_MAX_AGE_SECS):
+        flush_buffer(api_url)
+
+def flush_buffer(api_url):
+    """Envía los snapshots acumulados en una sola petición"""
+    if not _buf:
+        return True
+    # Un único snapshot se envía como objeto para mantener el formato original
+    payload = _buf[0] if len(_buf) == 1 else list(_buf)
+    info = _buf[-1]
+    count = len(_buf)
+    # Se vacía antes de enviar: un error al registrar el resultado no debe
+    # hacer que el lote se reenvíe en la siguiente iteración
+    _buf.clear()
+    success = send_to_api(payload, api_url)
+    if success:
+        print(f"✓ Enviado: IP={info['ip']}, {len(info['processes'])} procesos, CPU promedio: {(info['cpu'].get('frequency') or {}).get('current', 0)} MHz ({count} snapshot(s))")
+    else:
+        print("✗ Fallo en envío. Datos locales guardados en log")
+        logging.warning(orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode())
+    return success
+
 if __name__ == "__main__":
     logging.info("Iniciando agente")
     api_url = os.getenv('API_URL', sys.argv[1] if len(sys.argv) > 1 else 'http://localhost:8000/send')
@@ -184,18 +473,31 @@ if __name__ == "__main__":
     logging.info(f"Agent ID: {agent_id}")
     logging.info(f"API URL: {api_url}")
     logging.info(f"Intervalo: {interval}s")
+    logging.info(f"Lote: {BATCH_SIZE} snapshot(s) / {BATCH_MAX_AGE_SECS}s")
+    logging.info("El % de CPU se mide entre iteraciones: en la primera todos los procesos reportan 0.0")
     
+    # SIGHUP descarta la caché de datos estáticos para forzar su recálculo
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, _invalidate_caches)
+    # Al terminar (incluido SIGTERM de docker stop) se envía lo pendiente
+    atexit.register(flush_buffer, api_url)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    # Cadencia fija: cada iteración duerme hasta su deadline en lugar de
+    # `interval` completo, así el tiempo de recolección y envío no se acumula
+    next_deadline = time.monotonic()
     while True:
         try:
             logging.info("Nueva iteración")
             info = collect_system_info(agent_id)
-            success = send_to_api(info, api_url)
-            if success:
-                print(f"✓ Enviado: IP={info['ip']}, {len(info['processes'])} procesos, CPU promedio: {info['cpu'].get('frequency', {}).get('current', 0)} MHz")
-            else:
-                print("✗ Fallo en envío. Datos locales guardados en log")
-                logging.warning(json.dumps(info, indent=2))
+            buffer_snapshot(info, api_url)
         except Exception as e:
             print(f"Error en la recolección: {e}")
             logging.error(f"Error en la recolección: {e}", exc_info=True)
-        time.sleep(interval)
+        next_deadline += interval
+        sleep_for = next_deadline - time.monotonic()
+        if sleep_for > 0:
+            time.sleep(sleep_for)
+        else:
+            logging.warning(f"Iteración excedió el intervalo por {-sleep_for:.3f}s")
+            next_deadline = time.monotonic()
@@ -1,836 +1,509 @@
-from fastapi import FastAPI, HTTPException, Query, Response
-from fastapi.responses import HTMLResponse, StreamingResponse
-from pydantic import BaseModel
-from typing import List, Optional
-import json
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, ConfigDict
+from typing import List, Optional, Union
+import orjson
 import os
-import aiofiles
+import re
+import sqlite3
+import asyncio
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import csv
 import io
+import threading
+import time
+from functools import lru_cache
+from contextlib import asynccontextmanager
+
+import aggregate
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-app = FastAPI(title="System Info API")
+@asynccontextmanager
+async def lifespan(app):
+    """Abre la base de datos al arrancar y cierra la conexión de escritura al parar"""
+    await asyncio.to_thread(_init_db)
+    total, ips = await asyncio.to_thread(_fetchone, "SELECT COUNT(*), COUNT(DISTINCT ip) FROM records")
+    logging.info(f"Base de datos {DB_PATH}: {total} registros, {ips} IPs")
+    yield
+    if _write_conn is not None:
+        _write_conn.close()
+
+# Todas las respuestas JSON se serializan con orjson
+app = FastAPI(title="System Info API", default_response_class=ORJSONResponse, lifespan=lifespan)
+# Dashboard, estadísticas y descargas son texto muy comprimible; los streams se comprimen por fragmentos
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Submodelos tipados: la validación corre entera en pydantic-core en lugar de
+# revisar dicts genéricos. Los campos extra que envíe psutil se ignoran.
+class ProcessInfo(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    pid: int
+    name: Optional[str] = None
+    cpu_percent: float = 0.0
+    memory_percent: Optional[float] = None
+    status: Optional[str] = None
+
+class UserInfo(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    name: Optional[str] = None
+    terminal: Optional[str] = None
+    host: Optional[str] = None
+    started: float = 0.0
+    pid: Optional[int] = None
+
+class CpuFrequency(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    current: float = 0.0
+    min: float = 0.0
+    max: float = 0.0
+
+class CpuInfo(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    count: Optional[int] = None
+    frequency: Optional[CpuFrequency] = None
+    model: Optional[str] = None
+
+class OsInfo(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    name: Optional[str] = None
+    version: Optional[str] = None
+    release: Optional[str] = None
+    hostname: Optional[str] = None
 
 class SystemInfo(BaseModel):
+    model_config = ConfigDict(extra="ignore")
     ip: str
     agent_id: Optional[str] = None
-    cpu: dict
-    processes: List[dict]
-    users: List[dict]
-    os: dict
+    cpu: CpuInfo
+    processes: List[ProcessInfo]
+    users: List[UserInfo]
+    os: OsInfo
     timestamp: str
 
-async def save_to_json(data_entry, filename):
-    try:
-        if os.path.exists(filename):
-            async with aiofiles.open(filename, 'r') as f:
-                content = await f.read()
-                existing = json.loads(content) if content else []
-            existing.append(data_entry)
-        else:
-            existing = [data_entry]
-        async with aiofiles.open(filename, 'w') as f:
-            await f.write(json.dumps(existing, indent=2))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error guardando JSON: {e}")
+# Almacenamiento en SQLite: una tabla indexada en lugar de un JSONL por día.
+# El payload se guarda ya serializado (orjson) y las columnas que se filtran
+# o agregan se duplican fuera del JSON para que las consultas usen índices.
+DB_PATH = os.environ.get('DB_PATH', 'system_data.db')
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records(
+    id INTEGER PRIMARY KEY,
+    ip TEXT NOT NULL,
+    agent_id TEXT,
+    timestamp TEXT NOT NULL,
+    received_at TEXT NOT NULL,
+    received_at_epoch REAL,
+    os_name TEXT,
+    cpu_freq REAL NOT NULL DEFAULT 0,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ip ON records(ip);
+CREATE INDEX IF NOT EXISTS idx_ts ON records(received_at);
+CREATE INDEX IF NOT EXISTS idx_timestamp ON records(timestamp);
+CREATE INDEX IF NOT EXISTS idx_agent ON records(agent_id);
+CREATE TABLE IF NOT EXISTS imported_files(name TEXT PRIMARY KEY);
+"""
+INSERT_SQL = ("INSERT INTO records(ip, agent_id, timestamp, received_at, received_at_epoch, os_name, cpu_freq, payload) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+# Una única conexión de escritura (serializada con el lock) y una de lectura por hilo:
+# con WAL los lectores no bloquean al escritor ni al revés.
+_write_lock = threading.Lock()
+_write_conn = None
+_local = threading.local()
+# Las estadísticas dependen también de la hora (agentes activos, alerta sin datos),
+# así que el ETag caduca cada STATS_ETAG_SECS aunque no lleguen datos nuevos
+STATS_ETAG_SECS = 30
+# Respuesta de /api/stats reutilizada durante STATS_TTL_SECS; /send la invalida
+STATS_TTL_SECS = 1.0
+_stats_cache = {'stats': None, 'etag': None, 'expires': 0.0}
+# Grupos (OS, IP) que se envían a los gráficos del dashboard
+TOP_K_GROUPS = 10
+# Partes fijas de las alertas del dashboard; en cada cálculo solo se rellena el número
+_CRITICAL_ALERT = {"type": "danger", "icon": "🔴"}
+_CRITICAL_MSG = "⚠️ %d proceso(s) con CPU crítico (>80%%)".__mod__
+_WARNING_ALERT = {"type": "warning", "icon": "🟡"}
+_WARNING_MSG = "⚠️ %d proceso(s) con CPU elevado (50-80%%)".__mod__
+_STALE_ALERT = {"type": "warning", "icon": "⏰"}
+_STALE_MSG = "No se han recibido datos en %d minuto(s)".__mod__
+# Respuesta de /api/stats sin datos (solo cambia last_update)
+_EMPTY_STATS = {
+    "total_records": 0,
+    "active_agents": 0,
+    "avg_cpu": 0,
+    "total_processes": 0,
+    "active_users": 0,
+    "last_update": None,
+    "cpu_timeline": {"labels": [], "data": []},
+    "os_distribution": {"labels": [], "data": []},
+    "ip_activity": {"labels": [], "data": []},
+    "top_processes": {"labels": [], "data": []},
+    "processes": [],
+    "users": [],
+    "high_cpu_processes": [],
+    "alerts": []
+}
+
+def _connect():
+    """Abre una conexión a la base de datos en modo WAL"""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def _read_conn():
+    """Conexión de lectura del hilo actual, creada la primera vez"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = _connect()
+    return conn
+
+def _row(entry, received_epoch=None):
+    """Columnas de un registro para INSERT_SQL"""
+    cpu_data = entry.get('cpu') or {}
+    received_at = entry.get('received_at', entry['timestamp'])
+    if received_epoch is None:
+        # Registros importados: el epoch se deduce del ISO (hora local, como lo escribía la API)
+        try:
+            received_epoch = datetime.fromisoformat(received_at).timestamp()
+        except ValueError:
+            pass
+    return (
+        entry['ip'],
+        entry.get('agent_id'),
+        entry['timestamp'],
+        received_at,
+        received_epoch,
+        (entry.get('os') or {}).get('name') or 'Unknown',
+        (cpu_data.get('frequency') or {}).get('current', 0),
+        orjson.dumps(entry)
+    )
+
+def _insert_entries(data_entries, received_epochs):
+    """Inserta data_entries en una sola transacción (se ejecuta en un hilo)"""
+    with _write_lock, _write_conn:
+        _write_conn.executemany(INSERT_SQL, [_row(entry, epoch) for entry, epoch in zip(data_entries, received_epochs)])
+
+def _parse_jsonl(file, content):
+    """Parsea un JSONL línea a línea; una línea corrupta se omite sin descartar el resto"""
+    entries = []
+    for number, line in enumerate(content.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            entries.append(orjson.loads(line))
+        except orjson.JSONDecodeError as e:
+            logging.warning(f"Línea {number} de {file} inválida, se omitirá: {e}")
+    return entries
+
+def _parse_data_file(file, content):
+    """Parsea un archivo de datos: JSONL, o array JSON en los .json de las primeras versiones"""
+    if file.endswith('.jsonl'):
+        return _parse_jsonl(file, content)
+    data = orjson.loads(content)
+    return data if isinstance(data, list) else [data]
+
+# Nombre de los archivos de datos de versiones anteriores (.jsonl y los .json
+# antiguos); una sola llamada en C por entrada
+_is_data_file = re.compile(r'system_data_.+\.jsonl?').fullmatch
+
+def _iter_data_files():
+    """Recorre el directorio una vez y devuelve los archivos de datos"""
+    with os.scandir('.') as it:
+        for de in it:
+            if _is_data_file(de.name) and de.is_file(follow_symlinks=False):
+                yield de
+
+def _migrate(conn):
+    """Añade a una base de datos existente las columnas de versiones posteriores"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(records)")}
+    if 'received_at_epoch' not in columns:
+        conn.execute("ALTER TABLE records ADD COLUMN received_at_epoch REAL")
+        # received_at es hora local sin zona: 'utc' la convierte antes de pasar a epoch
+        conn.execute("UPDATE records SET received_at_epoch = (julianday(received_at, 'utc') - 2440587.5) * 86400.0")
+        logging.info("Base de datos migrada: columna received_at_epoch")
+
+def _init_db():
+    """Crea el esquema e importa una sola vez los archivos de datos anteriores a SQLite"""
+    global _write_conn
+    _write_conn = _connect()
+    with _write_lock, _write_conn:
+        _write_conn.executescript(SCHEMA)
+        _migrate(_write_conn)
+        imported = {name for (name,) in _write_conn.execute("SELECT name FROM imported_files")}
+        for file in sorted(de.name for de in _iter_data_files()):
+            if file in imported:
+                continue
+            try:
+                with open(file, 'rb') as f:
+                    entries = _parse_data_file(file, f.read())
+            except Exception as e:
+                logging.warning(f"Error al importar el archivo {file}, se omitirá: {e}")
+                continue
+            # Un registro sin ip/timestamp se omite sin descartar el resto del archivo
+            rows = []
+            for number, entry in enumerate(entries, 1):
+                try:
+                    rows.append(_row(entry))
+                except (KeyError, TypeError, AttributeError) as e:
+                    logging.warning(f"Registro {number} de {file} inválido, se omitirá: {e!r}")
+            _write_conn.executemany(INSERT_SQL, rows)
+            _write_conn.execute("INSERT INTO imported_files(name) VALUES (?)", (file,))
+            logging.info(f"Importados {len(rows)} registros de {file}")
+
+def _fetchone(sql, params=()):
+    """Ejecuta una consulta de lectura y devuelve la primera fila"""
+    return _read_conn().execute(sql, params).fetchone()
+
+def _fetchall(sql, params=()):
+    """Ejecuta una consulta de lectura y devuelve todas las filas"""
+    return _read_conn().execute(sql, params).fetchall()
 
 @app.post("/send")
-async def receive_info(info: SystemInfo):
-    timestamp_str = info.timestamp.replace(":", "-")
-    filename = f"system_data_{timestamp_str}.json"
+async def receive_info(info: Union[List[SystemInfo], SystemInfo]):
+    """Recibe un snapshot o un lote de snapshots enviados por el agente"""
+    batch = info if isinstance(info, list) else [info]
+    entries = []
+    epochs = []
+    for item in batch:
+        # El epoch se guarda junto al ISO para que las comprobaciones de tiempo no lo parseen
+        received_epoch = time.time()
+        data_entry = item.model_dump()
+        data_entry['received_at'] = datetime.fromtimestamp(received_epoch).isoformat()
+        entries.append(data_entry)
+        epochs.append(received_epoch)
    
-    data_entry = info.dict()
-    data_entry['received_at'] = datetime.now().isoformat()
-    await save_to_json(data_entry, filename)
+    try:
+        # Una transacción por lote; la E/S de disco no bloquea el event loop
+        await asyncio.to_thread(_insert_entries, entries, epochs)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error guardando datos: {e}")
+    _stats_cache['expires'] = 0.0
    
-    return {"status": "success", "filename": filename}
+    if isinstance(info, list):
+        return {"status": "success", "count": len(batch)}
+    return {"status": "success"}
 
-async def search_json_files(ip: str) -> List[dict]:
-    results = []
-    for file in os.listdir('.'):
-        if not (file.startswith("system_data_") and file.endswith(".json")):
-            continue
-        try:
-            async with aiofiles.open(file, 'r') as f:
-                content = await f.read()
-                data = json.loads(content) if content else []
-                results.extend(entry for entry in data if entry['ip'] == ip)
-        except Exception as e:
-            logging.warning(f"Error al procesar el archivo {file}, se omitirá: {e}")
-            continue
-    return results
+def _data_version():
+    """Versión de los datos: el id más alto, válido aunque escriban varios procesos"""
+    return _fetchone("SELECT COALESCE(MAX(id), 0) FROM records")[0]
 
-def get_all_data_from_json() -> List[dict]:
-    """Obtiene todos los datos de los archivos JSON"""
-    results = []
-    for file in os.listdir('.'):
-        if not (file.startswith("system_data_") and file.endswith(".json")):
-            continue
-        try:
-            with open(file, 'r') as f:
-                content = f.read()
-                data = json.loads(content) if content else []
-                results.extend(data)
-        except Exception as e:
-            logging.warning(f"Error al procesar el archivo {file}, se omitirá: {e}")
-            continue
-    return results
+def _ip_payloads(ip):
+    """Payloads JSON (sin parsear) de una IP, en orden de llegada"""
+    return [payload for (payload,) in _fetchall("SELECT payload FROM records WHERE ip = ? ORDER BY id", (ip,))]
 
 @app.get("/query")
 async def query_info(ip: str = Query(..., description="IP a consultar")):
-    results = await search_json_files(ip)
+    payloads = await asyncio.to_thread(_ip_payloads, ip)
    
-    if not results:
+    if not payloads:
         raise HTTPException(status_code=404, detail="IP no encontrada")
-    return {"results": results}
+    # Los payloads ya son JSON: se concatenan sin parsear ni volver a serializar
+    return Response(content=b'{"results":[' + b','.join(payloads) + b']}', media_type="application/json")
+
+# Registros por fragmento enviado (CSV y JSON): memoria constante sin un chunk HTTP por fila
+STREAM_CHUNK_ROWS = 256
+
+def _export_bounds(ip):
+    """Último id a exportar (instantánea al empezar la descarga) o 0 si no hay datos"""
+    if ip:
+        return _fetchone("SELECT COALESCE(MAX(id), 0) FROM records WHERE ip = ?", (ip,))[0]
+    return _data_version()
+
+def _fetch_chunk(ip, after_id, last_id):
+    """Siguiente fragmento de registros por id (paginación por clave)"""
+    where = "id > ? AND id <= ?" + (" AND ip = ?" if ip else "")
+    params = (after_id, last_id, ip) if ip else (after_id, last_id)
+    return _fetchall(f"SELECT id, payload FROM records WHERE {where} ORDER BY id LIMIT {STREAM_CHUNK_ROWS}", params)
+
+async def _iter_export(ip, last_id, render):
+    """Recorre la exportación por fragmentos; render(filas, primero) corre en un hilo"""
+    after_id = 0
+    while True:
+        rows = await asyncio.to_thread(_fetch_chunk, ip, after_id, last_id)
+        if not rows:
+            return
+        yield await asyncio.to_thread(render, rows, after_id == 0)
+        after_id = rows[-1][0]
 
 @app.get("/download/json")
 async def download_json(ip: Optional[str] = None):
     """Descarga todos los datos o filtrados por IP en formato JSON"""
-    if ip:
-        results = await search_json_files(ip)
-    else:
-        results = get_all_data_from_json()
+    last_id = await asyncio.to_thread(_export_bounds, ip)
    
-    if not results:
+    if not last_id:
         raise HTTPException(status_code=404, detail="No hay datos disponibles")
    
-    json_str = json.dumps(results, indent=2)
-    return Response(
-        content=json_str,
+    return StreamingResponse(
+        _json_array(ip, last_id),
         media_type="application/json",
         headers={"Content-Disposition": f"attachment; filename=system_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"}
     )
 
+def _dump_json_chunk(rows, first):
+    """Serializa un fragmento del array JSON"""
+    body = b',\n'.join(orjson.dumps(orjson.loads(payload), option=orjson.OPT_INDENT_2) for _, payload in rows)
+    return body if first else b',\n' + body
+
+async def _json_array(ip, last_id):
+    """Emite el array JSON en fragmentos serializados fuera del event loop, sin serializarlo entero"""
+    yield b'[\n'
+    async for chunk in _iter_export(ip, last_id, _dump_json_chunk):
+        yield chunk
+    yield b'\n]'
+
 @app.get("/download/csv")
 async def download_csv(ip: Optional[str] = None):
     """Descarga todos los datos o filtrados por IP en formato CSV"""
-    if ip:
-        results = await search_json_files(ip)
-    else:
-        results = get_all_data_from_json()
+    last_id = await asyncio.to_thread(_export_bounds, ip)
    
-    if not results:
+    if not last_id:
         raise HTTPException(status_code=404, detail="No hay datos disponibles")
    
-    output = io.StringIO()
-    fieldnames = ['ip', 'agent_id', 'cpu_count', 'cpu_frequency', 'os_name', 'os_version', 'timestamp', 'received_at']
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
-    writer.writeheader()
-   
-    for item in results:
-        cpu_data = item.get('cpu', {})
-        os_data = item.get('os', {})
-        writer.writerow({
-            'ip': item['ip'],
-            'agent_id': item.get('agent_id', ''),
-            'cpu_count': cpu_data.get('count', ''),
-            'cpu_frequency': cpu_data.get('frequency', {}).get('current', ''),
-            'os_name': os_data.get('name', ''),
-            'os_version': os_data.get('version', ''),
-            'timestamp': item['timestamp'],
-            'received_at': item['received_at']
-        })
-   
     return StreamingResponse(
-        iter([output.getvalue()]),
+        _csv_rows(ip, last_id),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=system_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"}
     )
 
-@app.get("/", response_class=HTMLResponse)
-async def dashboard():
-    """Dashboard completo con gráficos, procesos, usuarios y alertas"""
-    html_content = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>System Monitor Dashboard</title>
-        <script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js"></script>
-        <style>
-            * { box-sizing: border-box; margin: 0; padding: 0; }
-            body {
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                background: linear-gradient(135deg, #1a1a2e 0%, #16213e 100%);
-                color: #fff;
-                padding: 20px;
-            }
-            .container { max-width: 1600px; margin: 0 auto; }
-            .header {
-                text-align: center;
-                margin-bottom: 30px;
-                padding: 20px;
-                background: rgba(255,255,255,0.05);
-                border-radius: 10px;
-            }
-            .header h1 { font-size: 2.5em; margin-bottom: 10px; }
-            .stats {
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(220px, 1fr));
-                gap: 20px;
-                margin-bottom: 30px;
-            }
-            .stat-card {
-                background: linear-gradient(135deg, #2d2d2d 0%, #1a1a1a 100%);
-                padding: 25px;
-                border-radius: 10px;
-                text-align: center;
-                box-shadow: 0 8px 16px rgba(0,0,0,0.3);
-                transition: transform 0.3s;
-            }
-            .stat-card:hover { transform: translateY(-5px); }
-            .stat-value {
-                font-size: 2.5em;
-                font-weight: bold;
-                background: linear-gradient(45deg, #4CAF50, #8BC34A);
-                -webkit-background-clip: text;
-                -webkit-text-fill-color: transparent;
-                background-clip: text;
-            }
-            .stat-label { color: #999; margin-top: 10px; font-size: 0.9em; }
-            .grid {
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(500px, 1fr));
-                gap: 20px;
-                margin-bottom: 20px;
-            }
-            .chart-container {
-                background: rgba(45, 45, 45, 0.8);
-                padding: 25px;
-                border-radius: 10px;
-                box-shadow: 0 8px 16px rgba(0,0,0,0.3);
-            }
-            .chart-container h3 {
-                margin-bottom: 15px;
-                color: #4CAF50;
-                border-bottom: 2px solid #4CAF50;
-                padding-bottom: 10px;
-            }
-            .table-container {
-                background: rgba(45, 45, 45, 0.8);
-                padding: 25px;
-                border-radius: 10px;
-                margin-bottom: 20px;
-                box-shadow: 0 8px 16px rgba(0,0,0,0.3);
-                overflow-x: auto;
-            }
-            table {
-                width: 100%;
-                border-collapse: collapse;
-            }
-            th, td {
-                padding: 12px;
-                text-align: left;
-                border-bottom: 1px solid #444;
-            }
-            th {
-                background: #1a1a1a;
-                color: #4CAF50;
-                font-weight: 600;
-            }
-            tr:hover { background: rgba(76, 175, 80, 0.1); }
-            .alert {
-                padding: 15px;
-                margin-bottom: 10px;
-                border-radius: 5px;
-                display: flex;
-                align-items: center;
-                gap: 10px;
-            }
-            .alert-warning {
-                background: rgba(255, 152, 0, 0.2);
-                border-left: 4px solid #FF9800;
-            }
-            .alert-danger {
-                background: rgba(244, 67, 54, 0.2);
-                border-left: 4px solid #F44336;
-            }
-            .download-section {
-                text-align: center;
-                padding: 30px;
-                background: rgba(45, 45, 45, 0.8);
-                border-radius: 10px;
-                margin-top: 20px;
-            }
-            .btn {
-                background: linear-gradient(45deg, #4CAF50, #8BC34A);
-                color: white;
-                padding: 15px 30px;
-                border: none;
-                border-radius: 25px;
-                cursor: pointer;
-                font-size: 16px;
-                font-weight: 600;
-                margin: 0 10px;
-                text-decoration: none;
-                display: inline-block;
-                transition: all 0.3s;
-                box-shadow: 0 4px 8px rgba(0,0,0,0.3);
-            }
-            .btn:hover {
-                transform: translateY(-2px);
-                box-shadow: 0 6px 12px rgba(0,0,0,0.4);
-            }
-            .btn-secondary {
-                background: linear-gradient(45deg, #2196F3, #03A9F4);
-            }
-            .badge {
-                display: inline-block;
-                padding: 4px 8px;
-                border-radius: 12px;
-                font-size: 0.85em;
-                font-weight: 600;
-            }
-            .badge-success { background: #4CAF50; color: white; }
-            .badge-warning { background: #FF9800; color: white; }
-            .badge-danger { background: #F44336; color: white; }
-            .search-box {
-                margin: 20px 0;
-                padding: 15px;
-                background: rgba(45, 45, 45, 0.8);
-                border-radius: 10px;
-            }
-            .search-box input {
-                width: 100%;
-                padding: 12px;
-                border: 2px solid #444;
-                border-radius: 5px;
-                background: #1a1a1a;
-                color: #fff;
-                font-size: 16px;
-            }
-            .search-box input:focus {
-                outline: none;
-                border-color: #4CAF50;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>🖥️ System Monitor Dashboard</h1>
-                <p>Monitoreo completo en tiempo real del sistema</p>
-            </div>
-           
-            <!-- Estadísticas principales -->
-            <div class="stats">
-                <div class="stat-card">
-                    <div class="stat-value" id="totalRecords">0</div>
-                    <div class="stat-label">Total Registros</div>
-                </div>
-                <div class="stat-card">
-                    <div class="stat-value" id="activeAgents">0</div>
-                    <div class="stat-label">Agentes Activos</div>
-                </div>
-                <div class="stat-card">
-                    <div class="stat-value" id="avgCpu">0%</div>
-                    <div class="stat-label">CPU Promedio</div>
-                </div>
-                <div class="stat-card">
-                    <div class="stat-value" id="totalProcesses">0</div>
-                    <div class="stat-label">Procesos Monitoreados</div>
-                </div>
-                <div class="stat-card">
-                    <div class="stat-value" id="activeUsers">0</div>
-                    <div class="stat-label">Usuarios Conectados</div>
-                </div>
-                <div class="stat-card">
-                    <div class="stat-value" id="lastUpdate">-</div>
-                    <div class="stat-label">Última Actualización</div>
-                </div>
-            </div>
-
-            <!-- Alertas -->
-            <div class="table-container" id="alertsSection" style="display:none;">
-                <h3>⚠️ Alertas del Sistema</h3>
-                <div id="alertsContainer"></div>
-            </div>
-
-            <!-- Gráficos principales -->
-            <div class="grid">
-                <div class="chart-container">
-                    <h3>📊 Frecuencia CPU en el Tiempo</h3>
-                    <canvas id="cpuChart"></canvas>
-                </div>
-                <div class="chart-container">
-                    <h3>💻 Distribución de Sistemas Operativos</h3>
-                    <canvas id="osChart"></canvas>
-                </div>
-            </div>
-
-            <div class="chart-container">
-                <h3>🌐 Actividad por IP</h3>
-                <canvas id="ipChart"></canvas>
-            </div>
-
-            <!-- Procesos Top por CPU -->
-            <div class="table-container">
-                <h3>🔥 Procesos con Mayor Uso de CPU</h3>
-                <div class="search-box">
-                    <input type="text" id="processSearch" placeholder="🔍 Buscar proceso por nombre...">
-                </div>
-                <table id="processTable">
-                    <thead>
-                        <tr>
-                            <th>Proceso</th>
-                            <th>PID</th>
-                            <th>CPU %</th>
-                            <th>IP / Agente</th>
-                            <th>Estado</th>
-                            <th>Última vez visto</th>
-                        </tr>
-                    </thead>
-                    <tbody id="processTableBody">
-                        <tr><td colspan="6" style="text-align:center; color:#666;">Cargando datos...</td></tr>
-                    </tbody>
-                </table>
-            </div>
-
-            <!-- Gráfico de procesos -->
-            <div class="chart-container">
-                <h3>📈 Top 10 Procesos por Consumo de CPU</h3>
-                <canvas id="processChart"></canvas>
-            </div>
-
-            <!-- Usuarios conectados -->
-            <div class="table-container">
-                <h3>👥 Usuarios Conectados</h3>
-                <table>
-                    <thead>
-                        <tr>
-                            <th>Usuario</th>
-                            <th>Terminal</th>
-                            <th>Host</th>
-                            <th>IP / Agente</th>
-                            <th>Conectado desde</th>
-                        </tr>
-                    </thead>
-                    <tbody id="usersTableBody">
-                        <tr><td colspan="5" style="text-align:center; color:#666;">Cargando datos...</td></tr>
-                    </tbody>
-                </table>
-            </div>
-
-            <!-- Histórico de procesos problemáticos -->
-            <div class="table-container">
-                <h3>⚡ Histórico de Procesos con Alto Consumo (>50% CPU)</h3>
-                <table>
-                    <thead>
-                        <tr>
-                            <th>Proceso</th>
-                            <th>PID</th>
-                            <th>CPU %</th>
-                            <th>IP</th>
-                            <th>Timestamp</th>
-                        </tr>
-                    </thead>
-                    <tbody id="highCpuTableBody">
-                        <tr><td colspan="5" style="text-align:center; color:#666;">Cargando datos...</td></tr>
-                    </tbody>
-                </table>
-            </div>
-
-            <!-- Descargas -->
-            <div class="download-section">
-                <h3>📥 Descargar Datos</h3>
-                <a href="/download/json" class="btn" download>Descargar JSON</a>
-                <a href="/download/csv" class="btn btn-secondary" download>Descargar CSV</a>
-            </div>
-        </div>
-
-        <script>
-            // Configuración de gráficos con Chart.js 4.x
-            const cpuCtx = document.getElementById('cpuChart').getContext('2d');
-            const osCtx = document.getElementById('osChart').getContext('2d');
-            const ipCtx = document.getElementById('ipChart').getContext('2d');
-            const processCtx = document.getElementById('processChart').getContext('2d');
-
-            const chartOptions = {
-                responsive: true,
-                maintainAspectRatio: true,
-                plugins: { 
-                    legend: { 
-                        labels: { color: '#fff' } 
-                    } 
-                },
-                scales: {
-                    y: { 
-                        beginAtZero: true, 
-                        ticks: { color: '#999' }, 
-                        grid: { color: '#444' } 
-                    },
-                    x: { 
-                        ticks: { color: '#999' }, 
-                        grid: { color: '#444' } 
-                    }
-                }
-            };
-
-            const cpuChart = new Chart(cpuCtx, {
-                type: 'line',
-                data: {
-                    labels: [],
-                    datasets: [{
-                        label: 'Frecuencia CPU (MHz)',
-                        data: [],
-                        borderColor: '#4CAF50',
-                        backgroundColor: 'rgba(76, 175, 80, 0.1)',
-                        tension: 0.4,
-                        fill: true
-                    }]
-                },
-                options: chartOptions
-            });
-
-            const osChart = new Chart(osCtx, {
-                type: 'doughnut',
-                data: {
-                    labels: [],
-                    datasets: [{
-                        data: [],
-                        backgroundColor: ['#4CAF50', '#2196F3', '#FF9800', '#F44336', '#9C27B0']
-                    }]
-                },
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: true,
-                    plugins: { legend: { labels: { color: '#fff' } } }
-                }
-            });
-
-            const ipChart = new Chart(ipCtx, {
-                type: 'bar',
-                data: {
-                    labels: [],
-                    datasets: [{
-                        label: 'Registros por IP',
-                        data: [],
-                        backgroundColor: '#2196F3'
-                    }]
-                },
-                options: chartOptions
-            });
-
-            // CORRECCIÓN: Cambiar horizontalBar por bar con indexAxis: 'y'
-            const processChart = new Chart(processCtx, {
-                type: 'bar',
-                data: {
-                    labels: [],
-                    datasets: [{
-                        label: 'CPU %',
-                        data: [],
-                        backgroundColor: 'rgba(255, 152, 0, 0.8)'
-                    }]
-                },
-                options: {
-                    indexAxis: 'y',  // ESTO LO HACE HORIZONTAL
-                    responsive: true,
-                    maintainAspectRatio: true,
-                    plugins: { legend: { labels: { color: '#fff' } } },
-                    scales: {
-                        x: { 
-                            beginAtZero: true, 
-                            ticks: { color: '#999' }, 
-                            grid: { color: '#444' } 
-                        },
-                        y: { 
-                            ticks: { color: '#999' }, 
-                            grid: { color: '#444' } 
-                        }
-                    }
-                }
-            });
-
-            // Búsqueda de procesos
-            document.getElementById('processSearch').addEventListener('input', function(e) {
-                const searchTerm = e.target.value.toLowerCase();
-                const rows = document.querySelectorAll('#processTableBody tr');
-                rows.forEach(row => {
-                    const processName = row.cells[0]?.textContent.toLowerCase() || '';
-                    row.style.display = processName.includes(searchTerm) ? '' : 'none';
-                });
-            });
-
-            // Función para actualizar dashboard
-            async function updateDashboard() {
-                try {
-                    const response = await fetch('/api/stats');
-                    const data = await response.json();
-
-                    console.log('Data received:', data); // Debug
-
-                    // Actualizar estadísticas
-                    document.getElementById('totalRecords').textContent = data.total_records;
-                    document.getElementById('activeAgents').textContent = data.active_agents;
-                    document.getElementById('avgCpu').textContent = data.avg_cpu.toFixed(1) + '%';
-                    document.getElementById('totalProcesses').textContent = data.total_processes;
-                    document.getElementById('activeUsers').textContent = data.active_users;
-                    document.getElementById('lastUpdate').textContent = new Date(data.last_update).toLocaleTimeString();
-
-                    // Actualizar alertas
-                    if (data.alerts && data.alerts.length > 0) {
-                        document.getElementById('alertsSection').style.display = 'block';
-                        document.getElementById('alertsContainer').innerHTML = data.alerts.map(alert => 
-                            `<div class="alert alert-${alert.type}">
-                                <span style="font-size: 1.5em;">${alert.icon}</span>
-                                <span>${alert.message}</span>
-                            </div>`
-                        ).join('');
-                    } else {
-                        document.getElementById('alertsSection').style.display = 'none';
-                    }
-
-                    // Actualizar gráficos
-                    cpuChart.data.labels = data.cpu_timeline.labels;
-                    cpuChart.data.datasets[0].data = data.cpu_timeline.data;
-                    cpuChart.update();
-
-                    osChart.data.labels = data.os_distribution.labels;
-                    osChart.data.datasets[0].data = data.os_distribution.data;
-                    osChart.update();
-
-                    ipChart.data.labels = data.ip_activity.labels;
-                    ipChart.data.datasets[0].data = data.ip_activity.data;
-                    ipChart.update();
-
-                    processChart.data.labels = data.top_processes.labels;
-                    processChart.data.datasets[0].data = data.top_processes.data;
-                    processChart.update();
-
-                    // Actualizar tabla de procesos
-                    const processTableBody = document.getElementById('processTableBody');
-                    if (data.processes && data.processes.length > 0) {
-                        processTableBody.innerHTML = data.processes.map(proc => {
-                            const cpuPercent = proc.cpu_percent || 0;
-                            const badge = cpuPercent > 70 ? 'danger' : cpuPercent > 40 ? 'warning' : 'success';
-                            return `
-                                <tr>
-                                    <td><strong>${proc.name}</strong></td>
-                                    <td>${proc.pid}</td>
-                                    <td><span class="badge badge-${badge}">${cpuPercent.toFixed(1)}%</span></td>
-                                    <td>${proc.ip}</td>
-                                    <td><span class="badge badge-success">Activo</span></td>
-                                    <td>${new Date(proc.timestamp).toLocaleString()}</td>
-                                </tr>
-                            `;
-                        }).join('');
-                    } else {
-                        processTableBody.innerHTML = '<tr><td colspan="6" style="text-align:center; color:#666;">No hay datos disponibles</td></tr>';
-                    }
-
-                    // Actualizar tabla de usuarios
-                    const usersTableBody = document.getElementById('usersTableBody');
-                    if (data.users && data.users.length > 0) {
-                        usersTableBody.innerHTML = data.users.map(user => `
-                            <tr>
-                                <td><strong>${user.name}</strong></td>
-                                <td>${user.terminal}</td>
-                                <td>${user.host}</td>
-                                <td>${user.ip}</td>
-                                <td>${new Date(user.started * 1000).toLocaleString()}</td>
-                            </tr>
-                        `).join('');
-                    } else {
-                        usersTableBody.innerHTML = '<tr><td colspan="5" style="text-align:center; color:#666;">No hay usuarios conectados</td></tr>';
-                    }
-
-                    // Actualizar tabla de procesos con alto CPU
-                    const highCpuTableBody = document.getElementById('highCpuTableBody');
-                    if (data.high_cpu_processes && data.high_cpu_processes.length > 0) {
-                        highCpuTableBody.innerHTML = data.high_cpu_processes.map(proc => `
-                            <tr>
-                                <td><strong>${proc.name}</strong></td>
-                                <td>${proc.pid}</td>
-                                <td><span class="badge badge-danger">${proc.cpu_percent.toFixed(1)}%</span></td>
-                                <td>${proc.ip}</td>
-                                <td>${new Date(proc.timestamp).toLocaleString()}</td>
-                            </tr>
-                        `).join('');
-                    } else {
-                        highCpuTableBody.innerHTML = '<tr><td colspan="5" style="text-align:center; color:#666;">No hay procesos con alto consumo</td></tr>';
-                    }
-
-                } catch (error) {
-                    console.error('Error actualizando dashboard:', error);
-                }
-            }
-
-            // Actualizar cada 5 segundos
-            updateDashboard();
-            setInterval(updateDashboard, 5000);
-        </script>
-    </body>
-    </html>
-    """
-    return HTMLResponse(content=html_content)
+CSV_FIELDS = ['ip', 'agent_id', 'cpu_count', 'cpu_frequency', 'os_name', 'os_version', 'timestamp', 'received_at']
+
+def _csv_chunk(rows, first):
+    """Genera las filas CSV de un fragmento"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if first:
+        writer.writerow(CSV_FIELDS)
+    for _, payload in rows:
+        item = orjson.loads(payload)
+        cpu_data = item.get('cpu') or {}
+        os_data = item.get('os') or {}
+        writer.writerow([
+            item['ip'],
+            item.get('agent_id', ''),
+            cpu_data.get('count', ''),
+            (cpu_data.get('frequency') or {}).get('current', ''),
+            os_data.get('name', ''),
+            os_data.get('version', ''),
+            item['timestamp'],
+            item['received_at']
+        ])
+    return buf.getvalue()
+
+async def _csv_rows(ip, last_id):
+    """Genera el CSV por fragmentos"""
+    async for chunk in _iter_export(ip, last_id, _csv_chunk):
+        yield chunk
 
 @app.get("/api/stats")
-async def get_stats():
+async def get_stats(request: Request, response: Response):
     """Endpoint completo con estadísticas, procesos, usuarios y alertas"""
-    data = get_all_data_from_json()
-   
-    if not data:
-        return {
-            "total_records": 0,
-            "active_agents": 0,
-            "avg_cpu": 0,
-            "total_processes": 0,
-            "active_users": 0,
-            "last_update": datetime.now().isoformat(),
-            "cpu_timeline": {"labels": [], "data": []},
-            "os_distribution": {"labels": [], "data": []},
-            "ip_activity": {"labels": [], "data": []},
-            "top_processes": {"labels": [], "data": []},
-            "processes": [],
-            "users": [],
-            "high_cpu_processes": [],
-            "alerts": []
-        }
+    # Varios dashboards sondeando a la vez comparten la respuesta durante STATS_TTL_SECS
+    # sin tocar la base de datos ni el threadpool
+    now = time.monotonic()
+    if _stats_cache['expires'] <= now:
+        version = await asyncio.to_thread(_data_version)
+        bucket = int(time.time() // STATS_ETAG_SECS)
+        # Consultas y agregación en un hilo para no bloquear los /send concurrentes
+        _stats_cache['stats'] = await asyncio.to_thread(_compute_stats, version, bucket)
+        _stats_cache['etag'] = f'W/"{version}-{bucket}"'
+        _stats_cache['expires'] = now + STATS_TTL_SECS
+    etag = _stats_cache['etag']
+    
+    # Si no hay datos nuevos desde el último sondeo del dashboard, 304 sin recalcular
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return _stats_cache['stats']
+
+@lru_cache(maxsize=1)
+def _compute_stats(version, bucket):
+    """Calcula las estadísticas una sola vez por versión de datos y tramo de tiempo"""
+    total_records = _fetchone("SELECT COUNT(*) FROM records")[0]
    
-    # Estadísticas básicas
-    total_records = len(data)
+    if not total_records:
+        # Sin datos no hay nada que agregar: respuesta vacía preparada al importar
+        return {**_EMPTY_STATS, "last_update": datetime.now().isoformat()}
     
     # Contar agentes únicos (considerando solo los últimos 5 minutos como activos)
-    recent_agents = set()
-    cutoff_time = datetime.now().timestamp() - 300  # 5 minutos
-    for item in data:
-        try:
-            item_time = datetime.fromisoformat(item.get('received_at', item.get('timestamp'))).timestamp()
-            if item_time > cutoff_time and item.get('agent_id'):
-                recent_agents.add(item['agent_id'])
-        except:
-            if item.get('agent_id'):
-                recent_agents.add(item['agent_id'])
-    
-    unique_agents = len(recent_agents)
+    # ISO 8601 ordena igual como texto: comparación directa que además usa idx_ts
+    cutoff_iso = (datetime.now() - timedelta(seconds=300)).isoformat()  # 5 minutos
+    unique_agents = _fetchone(
+        "SELECT COUNT(DISTINCT agent_id) FROM records WHERE received_at > ?",
+        (cutoff_iso,)
+    )[0]
    
     # CPU promedio
-    cpu_freqs = [item['cpu'].get('frequency', {}).get('current', 0) for item in data if item.get('cpu')]
-    avg_cpu = sum(cpu_freqs) / len(cpu_freqs) if cpu_freqs else 0
+    avg_cpu = _fetchone("SELECT AVG(cpu_freq) FROM records")[0] or 0
    
-    # Timeline de CPU (últimos 20 registros)
-    recent_data = sorted(data, key=lambda x: x['timestamp'])[-20:]
+    # Timeline de CPU (últimos 20 registros) por el índice de timestamp
+    recent_data = [orjson.loads(payload) for (payload,) in reversed(_fetchall(
+        "SELECT payload FROM records ORDER BY timestamp DESC LIMIT 20"
+    ))]
     cpu_timeline = {
         "labels": [item['timestamp'].split('T')[1][:8] for item in recent_data],
-        "data": [item['cpu'].get('frequency', {}).get('current', 0) for item in recent_data]
+        "data": [((item.get('cpu') or {}).get('frequency') or {}).get('current', 0) for item in recent_data]
     }
    
-    # Distribución de OS (por agente único, no por registro)
-    os_by_agent = {}
-    for item in data:
-        agent_id = item.get('agent_id', item.get('ip'))  # Usar agent_id o IP como fallback
-        os_name = item.get('os', {}).get('name', 'Unknown')
-        # Solo contar cada agente una vez
-        if agent_id:
-            os_by_agent[agent_id] = os_name
-    
-    # Contar cuántos agentes por OS
-    os_counts = {}
-    for os_name in os_by_agent.values():
-        os_counts[os_name] = os_counts.get(os_name, 0) + 1
-   
+    # Distribución de OS y actividad por IP (por agente único, según su último registro)
+    # COALESCE cubre las filas guardadas sin OS antes de que _row rellenara 'Unknown'
+    # Solo los TOP_K_GROUPS mayores para los gráficos
+    latest_per_agent = "SELECT MAX(id) FROM records WHERE agent_id IS NOT NULL GROUP BY agent_id"
+    os_counts = _fetchall(
+        f"SELECT COALESCE(os_name, 'Unknown') AS os, COUNT(*) AS n FROM records WHERE id IN ({latest_per_agent}) "
+        "GROUP BY os ORDER BY n DESC LIMIT ?", (TOP_K_GROUPS,)
+    )
     os_distribution = {
-        "labels": list(os_counts.keys()),
-        "data": list(os_counts.values())
+        "labels": [k for k, _ in os_counts],
+        "data": [v for _, v in os_counts]
     }
    
-    # Actividad por IP (por agente único, no por registro)
-    ip_by_agent = {}
-    for item in data:
-        agent_id = item.get('agent_id', item.get('ip'))
-        ip = item['ip']
-        # Guardar la IP de cada agente único
-        if agent_id:
-            ip_by_agent[agent_id] = ip
-    
-    # Contar cuántos agentes por IP
-    ip_counts = {}
-    for ip in ip_by_agent.values():
-        ip_counts[ip] = ip_counts.get(ip, 0) + 1
-   
+    ip_counts = _fetchall(
+        f"SELECT ip, COUNT(*) AS n FROM records WHERE id IN ({latest_per_agent}) "
+        "GROUP BY ip ORDER BY n DESC LIMIT ?", (TOP_K_GROUPS,)
+    )
     ip_activity = {
-        "labels": list(ip_counts.keys()),
-        "data": list(ip_counts.values())
-    }
-    
-    # Procesos más recientes y su análisis
-    latest_data = sorted(data, key=lambda x: x['timestamp'])[-10:]
-    all_processes = []
-    for item in latest_data:
-        for proc in item.get('processes', []):
-            all_processes.append({
-                'name': proc.get('name', 'Unknown'),
-                'pid': proc.get('pid', 0),
-                'cpu_percent': proc.get('cpu_percent', 0),
-                'ip': item['ip'],
-                'timestamp': item['timestamp']
-            })
-    
-    # Top 10 procesos por CPU
-    top_processes_list = sorted(all_processes, key=lambda x: x['cpu_percent'], reverse=True)[:10]
-    top_processes = {
-        "labels": [f"{p['name']} (PID: {p['pid']})" for p in top_processes_list],
-        "data": [p['cpu_percent'] for p in top_processes_list]
+        "labels": [k for k, _ in ip_counts],
+        "data": [v for _, v in ip_counts]
     }
     
-    # Procesos con alto consumo (>50%)
-    high_cpu_processes = [p for p in all_processes if p['cpu_percent'] > 50][:20]
-    
-    # Total de procesos únicos
-    total_processes = len(set(p['name'] for p in all_processes))
-    
-    # Usuarios conectados (últimos datos)
-    all_users = []
-    for item in latest_data:
-        for user in item.get('users', []):
-            user_copy = user.copy()
-            user_copy['ip'] = item['ip']
-            all_users.append(user_copy)
-    
-    # Eliminar usuarios duplicados
-    unique_users = []
-    seen = set()
-    for user in all_users:
-        key = f"{user.get('name')}-{user.get('terminal')}-{user.get('ip')}"
-        if key not in seen:
-            seen.add(key)
-            unique_users.append(user)
+    # Procesos y usuarios de los registros más recientes (aggregate.py, compilable con mypyc)
+    latest_data = recent_data[-10:]
+    processes = aggregate.analyze_processes(latest_data)
+    top_processes_list = processes["top_processes_list"]
+    top_processes = processes["top_processes"]
+    high_cpu_processes = processes["high_cpu_processes"]
+    total_processes = processes["total_processes"]
+    critical_count = processes["critical_count"]
+    warning_count = processes["warning_count"]
     
+    unique_users = aggregate.unique_users(latest_data)
     active_users = len(unique_users)
     
     # Generar alertas
     alerts = []
     
     # Alerta de procesos con alto CPU
-    critical_processes = [p for p in all_processes if p['cpu_percent'] > 80]
-    if critical_processes:
-        alerts.append({
-            "type": "danger",
-            "icon": "🔴",
-            "message": f"⚠️ {len(critical_processes)} proceso(s) con CPU crítico (>80%)"
-        })
+    if critical_count:
+        alerts.append({**_CRITICAL_ALERT, "message": _CRITICAL_MSG(critical_count)})
     
     # Alerta de procesos con CPU alto
-    warning_processes = [p for p in all_processes if 50 < p['cpu_percent'] <= 80]
-    if warning_processes:
-        alerts.append({
-            "type": "warning",
-            "icon": "🟡",
-            "message": f"⚠️ {len(warning_processes)} proceso(s) con CPU elevado (50-80%)"
-        })
+    if warning_count:
+        alerts.append({**_WARNING_ALERT, "message": _WARNING_MSG(warning_count)})
     
     # Alerta si no hay datos recientes
-    if data:
-        last_timestamp = datetime.fromisoformat(data[-1]['received_at'])
-        time_diff = (datetime.now() - last_timestamp).total_seconds()
-        if time_diff > 120:  # Más de 2 minutos sin datos
-            alerts.append({
-                "type": "warning",
-                "icon": "⏰",
-                "message": f"No se han recibido datos en {int(time_diff/60)} minuto(s)"
-            })
+    last_update, last_epoch = _fetchone("SELECT received_at, received_at_epoch FROM records ORDER BY id DESC LIMIT 1")
+    if last_epoch is None:
+        # Fila sin epoch (received_at no era ISO al importarla): se intenta con received_at
+        try:
+            last_epoch = datetime.fromisoformat(last_update).timestamp()
+        except (TypeError, ValueError):
+            logging.warning(f"Último registro sin fecha de recepción válida: {last_update!r}")
+    time_diff = time.time() - last_epoch if last_epoch is not None else 0
+    if time_diff > 120:  # Más de 2 minutos sin datos
+        alerts.append({**_STALE_ALERT, "message": _STALE_MSG(int(time_diff/60))})
     
     return {
         "total_records": total_records,
@@ -838,7 +511,7 @@ async def get_stats():
         "avg_cpu": avg_cpu / 1000,  # Convertir MHz a GHz
         "total_processes": total_processes,
         "active_users": active_users,
-        "last_update": data[-1]['received_at'] if data else datetime.now().isoformat(),
+        "last_update": last_update,
         "cpu_timeline": cpu_timeline,
         "os_distribution": os_distribution,
         "ip_activity": ip_activity,
@@ -847,4 +520,19 @@ async def get_stats():
         "users": unique_users,
         "high_cpu_processes": high_cpu_processes,
         "alerts": alerts
-    }
\ No newline at end of file
+    }
+
+# El dashboard es un HTML estático: se sirve desde disco sin trabajo en Python.
+# Se monta al final para que las rutas de la API tengan prioridad sobre "/".
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_CACHE_CONTROL = "public, max-age=300"
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles con Cache-Control: solo el mount estático paga la cabecera, sin
+    middleware en /send, /api/stats ni las descargas"""
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers.setdefault("Cache-Control", STATIC_CACHE_CONTROL)
+        return response
+
+app.mount("/", CachedStaticFiles(directory=STATIC_DIR, html=True), name="static")
@@ -0,0 +1,85 @@
+"""Agregaciones de /api/stats sobre los últimos registros.
+
+Módulo de Python puro y anotado para poder compilarlo con mypyc en la imagen
+(ver Dockerfile); sin compilar funciona igual.
+"""
+import heapq
+from itertools import repeat
+from operator import itemgetter
+from typing import Any, Dict, List, Set, Tuple
+
+def reduce_cpu(cpus: List[float]) -> Tuple[int, int, List[int], List[int]]:
+    """Reducción numérica sobre la columna de CPU: (críticos >80, elevados 50-80,
+    índices del top 10, índices de los primeros 20 >50)"""
+    critical_count: int = 0
+    warning_count: int = 0
+    high_idx: List[int] = []
+    for i, cpu in enumerate(cpus):
+        if cpu > 50:
+            if cpu > 80:
+                critical_count += 1
+            else:
+                warning_count += 1
+            if len(high_idx) < 20:
+                high_idx.append(i)
+    # Ambos son estables: en empates gana el que llegó antes. Con 10 o menos
+    # procesos basta un sort, sin montar el heap de nlargest
+    n = len(cpus)
+    top_idx: List[int]
+    if n <= 10:
+        top_idx = sorted(range(n), key=cpus.__getitem__, reverse=True)
+    else:
+        top_idx = heapq.nlargest(10, range(n), key=cpus.__getitem__)
+    return critical_count, warning_count, top_idx, high_idx
+
+def process_row(proc: Dict[str, Any], item: Dict[str, Any]) -> Dict[str, Any]:
+    """Fila de proceso que devuelve /api/stats"""
+    return {
+        'name': proc.get('name', 'Unknown'),
+        'pid': proc.get('pid', 0),
+        'cpu_percent': proc.get('cpu_percent', 0),
+        'ip': item['ip'],
+        'timestamp': item['timestamp']
+    }
+
+def analyze_processes(latest_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Top 10 por CPU, procesos con alto consumo, procesos únicos y contadores de alertas"""
+    # Columnas paralelas (SoA): la reducción trabaja sobre la lista de floats y los
+    # dicts de salida se crean solo para las filas que se devuelven. extend con
+    # entradas de tamaño conocido dimensiona cada lista de una vez
+    procs: List[Dict[str, Any]] = []
+    owners: List[Dict[str, Any]] = []  # registro de cada proceso (ip, timestamp)
+    for item in latest_data:
+        item_procs = item.get('processes', ())
+        procs.extend(item_procs)
+        owners.extend(repeat(item, len(item_procs)))
+    cpus: List[float] = [proc.get('cpu_percent', 0) for proc in procs]
+    names: Set[Any] = {proc.get('name', 'Unknown') for proc in procs}
+
+    critical_count, warning_count, top_idx, high_idx = reduce_cpu(cpus)
+    top_processes_list = [process_row(procs[i], owners[i]) for i in top_idx]
+    return {
+        "top_processes_list": top_processes_list,
+        "top_processes": {
+            "labels": [f"{name} (PID: {pid})" for name, pid in map(itemgetter('name', 'pid'), top_processes_list)],
+            "data": [cpus[i] for i in top_idx]
+        },
+        "high_cpu_processes": [process_row(procs[i], owners[i]) for i in high_idx],
+        "total_processes": len(names),
+        "critical_count": critical_count,
+        "warning_count": warning_count
+    }
+
+def unique_users(latest_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Usuarios conectados sin duplicados: clave tupla en lugar de un f-string y
+    copia solo del primero de cada clave"""
+    users_by_key: Dict[Tuple[Any, Any, Any], Dict[str, Any]] = {}
+    for item in latest_data:
+        ip = item['ip']
+        for user in item.get('users', []):
+            key = (user.get('name'), user.get('terminal'), ip)
+            if key not in users_by_key:
+                # copy() + asignación es más rápido que {**user, 'ip': ip} (medido con timeit)
+                user_copy = users_by_key[key] = user.copy()
+                user_copy['ip'] = ip
+    return list(users_by_key.values())